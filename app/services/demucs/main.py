@@ -5,41 +5,831 @@ FastAPI service that uses Facebook's Demucs for AI-powered audio stem separation
 
 import os
 import io
+import re
 import uuid
+import json
+import shutil
+import asyncio
 import tempfile
 import logging
+import zipfile
+import functools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, Optional
 
 import torch
+import torch.nn.functional as F
 import torchaudio
+import soundfile as sf
+from zipstream import ZipStream
+from blake3 import blake3
 from fastapi import FastAPI, File, UploadFile, HTTPException, Query
-from fastapi.responses import StreamingResponse, JSONResponse
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
 from pydantic import BaseModel
 import demucs.api
+from demucs.apply import BagOfModels, apply_model
+from demucs.audio import convert_audio
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# HTDemucs runs the same convolution shapes for every chunk, so let cuDNN autotune them
+torch.backends.cudnn.benchmark = True
+
 app = FastAPI(
     title="Demucs Stem Separation Service",
     description="AI-powered audio stem separation using Facebook's Demucs",
     version="1.0.0"
 )
 
-# Model cache
-_separator: Optional[demucs.api.Separator] = None
+# Model cache: one separator per model name, least recently used evicted first
+MAX_MODELS = int(os.environ.get("DEMUCS_MAX_MODELS", 2))
+_separators: "OrderedDict[str, demucs.api.Separator]" = OrderedDict()
+# In-flight loads, so concurrent requests for one model share a load and others aren't blocked
+_separator_loads: dict[str, asyncio.Future] = {}
+
+# CUDA graphs: per-chunk forward captured once per input shape, then replayed. Off by default:
+# HTDemucs' STFT builds its window on the host each call, which capture may reject.
+CUDA_GRAPHS = os.environ.get("DEMUCS_CUDA_GRAPHS", "0") == "1"
+
+# Reduced precision on CUDA: "auto" picks bf16 on Ampere+ and fp16 on older GPUs
+PRECISION = os.environ.get("DEMUCS_PRECISION", "auto")
+
+def _precision_dtype(device: str) -> Optional[torch.dtype]:
+    """Autocast dtype for the given device, or None to run in FP32."""
+    if device != "cuda" or PRECISION == "fp32":
+        return None
+    if PRECISION == "bf16":
+        return torch.bfloat16
+    if PRECISION == "fp16":
+        return torch.float16
+    return torch.bfloat16 if torch.cuda.get_device_capability()[0] >= 8 else torch.float16
+
+def _autocast(device: str):
+    """Autocast context for a forward pass (cache disabled so CUDA graphs can capture it)."""
+    dtype = _precision_dtype(device)
+    if dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type="cuda", dtype=dtype, cache_enabled=False)
+
+def _to_fp32(value):
+    if isinstance(value, torch.Tensor):
+        if value.is_complex():
+            return value.to(torch.complex64)
+        if value.is_floating_point():
+            return value.float()
+    return value
+
+def _keep_fp32(method):
+    """Run a spectral helper in FP32 with autocast off; reduced-precision FFTs are unstable."""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        with torch.autocast(device_type="cuda", enabled=False):
+            return method(*map(_to_fp32, args), **{k: _to_fp32(v) for k, v in kwargs.items()})
+    return wrapper
+
+def _inner_models(separator: demucs.api.Separator) -> list[torch.nn.Module]:
+    """The individual networks behind a separator (a bag may hold several)."""
+    model = separator.model
+    return list(model.models) if isinstance(model, BagOfModels) else [model]
+
+def _capture_graph(model: torch.nn.Module, x: torch.Tensor):
+    """Warm up on a side stream, then capture one forward pass as a CUDA graph."""
+    static_in = torch.empty_like(x)
+    static_in.copy_(x)
+    stream = torch.cuda.Stream()
+    stream.wait_stream(torch.cuda.current_stream())
+    with torch.cuda.stream(stream):
+        for _ in range(3):
+            model._orig_forward(static_in)
+    torch.cuda.current_stream().wait_stream(stream)
+    graph = torch.cuda.CUDAGraph()
+    # Thread-local so CUDA calls from encode threads and the event loop don't abort the capture
+    with torch.cuda.graph(graph, capture_error_mode="thread_local"):
+        static_out = model._orig_forward(static_in)
+    return graph, static_in, static_out
+
+def _install_graphed_forward(model: torch.nn.Module) -> None:
+    """Route model.forward through its CUDA graph cache, reverting to eager mode if capture fails."""
+    model._orig_forward = model.forward
+    # Graphs live on the model so they are freed with it and never outlive its weights
+    model._graphs = {}
+
+    def forward(x: torch.Tensor) -> torch.Tensor:
+        if not x.is_cuda:
+            return model._orig_forward(x)
+        # Chunks may replay on different streams; each stream needs its own static buffers
+        key = (tuple(x.shape), x.dtype, torch.cuda.current_stream().cuda_stream)
+        if key not in model._graphs:
+            try:
+                model._graphs[key] = _capture_graph(model, x)
+                logger.info(f"Captured CUDA graph for input shape {tuple(x.shape)}")
+            except Exception as e:
+                # A failure is structural, not shape-specific: stop retrying for this model
+                logger.warning(f"CUDA graph capture failed, running eagerly: {e}")
+                model.forward = model._orig_forward
+                return model._orig_forward(x)
+        graph, static_in, static_out = model._graphs[key]
+        static_in.copy_(x)
+        graph.replay()
+        return static_out.clone()
+
+    model.forward = forward
+
+# torch.compile (Inductor) fused kernels; "reduce-overhead" also replaces the manual CUDA graphs
+COMPILE = os.environ.get("DEMUCS_COMPILE", "0") == "1"
+
+def _install_compiled_forward(model: torch.nn.Module) -> None:
+    """
+    Route model.forward through torch.compile, falling back to eager mode on failure.
+    
+    "reduce-overhead" records CUDA graphs with the parameters as static inputs, which relies
+    on _load_separator keeping the weights resident on the device between batches.
+    """
+    eager = model.forward
+    compiled = torch.compile(eager, mode="reduce-overhead", fullgraph=False, dynamic=True)
+
+    def forward(x: torch.Tensor) -> torch.Tensor:
+        nonlocal compiled
+        if compiled is not None:
+            try:
+                return compiled(x)
+            except Exception as e:
+                logger.error(f"torch.compile failed, running eagerly from now on: {e}", exc_info=True)
+                compiled = None
+        return eager(x)
+
+    model.forward = forward
+
+# Throughput-oriented defaults: demucs' own shifts=1 / overlap=0.25 cost 2-5x more forward
+# passes for a marginal quality gain. Clients can opt back in per request.
+DEFAULT_SHIFTS = 0
+DEFAULT_OVERLAP = 0.1
+
+def _load_separator(model: str) -> demucs.api.Separator:
+    """Load a Demucs separator and prepare it for inference."""
+    logger.info(f"Loading Demucs model: {model}")
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    logger.info(f"Using device: {device}")
+    separator = demucs.api.Separator(
+        model=model,
+        device=device,
+        shifts=DEFAULT_SHIFTS,
+        overlap=DEFAULT_OVERLAP,
+        split=True,
+        segment=None
+    )
+    # Keep the weights resident on the device. Separator leaves them on the CPU and apply_model
+    # moves each bag member to the device and back around every forward, which re-uploads the
+    # weights per batch and leaves captured CUDA graphs pointing at freed storage.
+    separator.model.to(device)
+    # Inference only: skip autograd bookkeeping for the weights
+    separator.model.eval()
+    for param in separator.model.parameters():
+        param.requires_grad_(False)
+    dtype = _precision_dtype(device)
+    if dtype is not None:
+        logger.info(f"Casting model weights to {dtype}")
+        for inner in _inner_models(separator):
+            inner.to(dtype)
+            # STFT / ISTFT and complex masking stay in FP32
+            for name in ("_spec", "_ispec", "_mask"):
+                if hasattr(inner, name):
+                    setattr(inner, name, _keep_fp32(getattr(inner, name)))
+    if COMPILE:
+        for inner in _inner_models(separator):
+            _install_compiled_forward(inner)
+    elif device == "cuda" and CUDA_GRAPHS:
+        for inner in _inner_models(separator):
+            _install_graphed_forward(inner)
+    logger.info("Model loaded successfully")
+    return separator
+
+def _evict_separator(model: str, separator: demucs.api.Separator) -> None:
+    """
+    Drop an evicted separator and return cached memory to the driver.
+    
+    Jobs already queued keep the separator alive; its weights and CUDA graphs are freed
+    together once the last of them finishes.
+    """
+    logger.info(f"Evicting Demucs model: {model}")
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+
+async def _load_and_register(model: str) -> demucs.api.Separator:
+    """Load a separator off the event loop and add it to the cache, evicting beyond MAX_MODELS."""
+    try:
+        separator = await asyncio.to_thread(_load_separator, model)
+        _separators[model] = separator
+        while len(_separators) > MAX_MODELS:
+            _evict_separator(*_separators.popitem(last=False))
+        return separator
+    finally:
+        del _separator_loads[model]
+
+async def get_separator(model: str = "htdemucs") -> demucs.api.Separator:
+    """Get or create the Demucs separator for a model (cached for performance)."""
+    separator = _separators.get(model)
+    if separator is not None:
+        _separators.move_to_end(model)
+        return separator
+    loading = _separator_loads.get(model)
+    if loading is None:
+        loading = _separator_loads[model] = asyncio.ensure_future(_load_and_register(model))
+    # Shielded: a disconnecting client must not cancel a load other requests are waiting on
+    return await asyncio.shield(loading)
+
+# Micro-batching: concurrent requests are coalesced into one batched forward pass
+MAX_BATCH_SIZE = int(os.environ.get("DEMUCS_MAX_BATCH_SIZE", 4))
+BATCH_WINDOW_MS = float(os.environ.get("DEMUCS_BATCH_WINDOW_MS", 25))
+BATCH_ITEM_MB = int(os.environ.get("DEMUCS_BATCH_ITEM_MB", 1536))
+
+@dataclass(eq=False)
+class _SeparationJob:
+    separator: demucs.api.Separator
+    wav: torch.Tensor
+    future: asyncio.Future
+    # Stems the caller needs; None means all of them
+    stems: Optional[frozenset[str]] = None
+    shifts: int = DEFAULT_SHIFTS
+    overlap: float = DEFAULT_OVERLAP
+
+    @property
+    def batch_key(self) -> tuple:
+        """Jobs can share a forward pass only with the same model and apply settings."""
+        return (id(self.separator), self.shifts, self.overlap)
+
+_separation_queue: Optional[asyncio.Queue] = None
+_batch_worker: Optional[asyncio.Task] = None
+# Forward passes always run on one thread: CUDA graphs, compiled graph trees and streams are thread-affine
+_inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="demucs-inference")
+
+# A job joins a batch only if at least this share of the padded batch is real audio
+MIN_BATCH_FILL = 0.5
+
+# Worker processes sharing the GPU; each sees the same free VRAM, so each budgets only its share
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", 1))
+
+def _vram_budget() -> int:
+    """Bytes this process can still allocate: its share of free VRAM plus its own cached, unused blocks."""
+    free_bytes, _ = torch.cuda.mem_get_info()
+    return free_bytes // WORKERS + torch.cuda.memory_reserved() - torch.cuda.memory_allocated()
+
+def _item_bytes(separator: demucs.api.Separator, length: int) -> int:
+    """
+    Estimated VRAM for one batch item padded to `length` samples.
+    
+    Chunk activations are a fixed cost (BATCH_ITEM_MB); on top of that the mix, apply_model's
+    (S, C, T) output and the bag's (S, C, T) estimates live on the GPU for the whole track.
+    """
+    sources = len(separator.model.sources)
+    track_bytes = (1 + 2 * sources) * separator.audio_channels * length * 4
+    return BATCH_ITEM_MB * 1024 * 1024 + track_bytes
+
+def _select_batch(backlog: list[_SeparationJob], limit: int) -> list[_SeparationJob]:
+    """
+    The head job plus compatible jobs that fit in VRAM once padded to the batch's longest track.
+    
+    Jobs that would mostly pad the batch (a long track next to short ones) wait for a later batch.
+    """
+    head = backlog[0]
+    batch = [head]
+    if limit == 1:
+        return batch
+    budget = _vram_budget()
+    total = max_len = head.wav.shape[-1]
+    for job in backlog[1:]:
+        if len(batch) >= limit:
+            break
+        if job.batch_key != head.batch_key:
+            continue
+        length = job.wav.shape[-1]
+        padded = max(max_len, length)
+        if total + length < MIN_BATCH_FILL * (len(batch) + 1) * padded:
+            continue
+        if (len(batch) + 1) * _item_bytes(head.separator, padded) > budget:
+            continue
+        batch.append(job)
+        total += length
+        max_len = padded
+    return batch
+
+# Page-locked staging buffers for host-to-device copies. Batch rows are bucketed into a few
+# audio-length size classes so the same buffers are reused instead of reallocated; total
+# pinned memory is capped, and rows beyond the cap or every size class copy from pageable memory.
+BUFFER_BUCKETS = sorted(int(b) for b in os.environ.get("DEMUCS_BUFFER_BUCKETS", "60,180,600").split(","))
+PINNED_MAX_BYTES = int(os.environ.get("DEMUCS_PINNED_MB", 512)) * 1024 * 1024
+# (channels, bucket) -> one [buffer, pending copy event] slot per batch row
+_pinned_pool: dict[tuple[int, int], list[list]] = {}
+_pinned_bytes = 0
+_copy_stream: Optional[torch.cuda.Stream] = None
+
+def _bucket_length(length: int, samplerate: int) -> Optional[int]:
+    """Samples in the smallest size class that holds `length`, or None if none does."""
+    for seconds in BUFFER_BUCKETS:
+        if length <= seconds * samplerate:
+            return seconds * samplerate
+    return None
+
+def _pinned_buffer(channels: int, bucket: int, row: int) -> Optional[torch.Tensor]:
+    """Flat pinned buffer for a batch row, waiting out any copy still reading it; None past the cap."""
+    global _pinned_bytes
+    slots = _pinned_pool.setdefault((channels, bucket), [])
+    while len(slots) <= row:
+        size = channels * bucket * 4
+        if _pinned_bytes + size > PINNED_MAX_BYTES:
+            return None
+        slots.append([torch.empty(channels * bucket, pin_memory=True), None])
+        _pinned_bytes += size
+    pinned, pending = slots[row]
+    if pending is not None:
+        pending.synchronize()
+    return pinned
+
+def _preallocate_buffers(channels: int, samplerate: int) -> None:
+    """Allocate the single-item staging buffer of every size class up front."""
+    for seconds in BUFFER_BUCKETS:
+        _pinned_buffer(channels, seconds * samplerate, 0)
+
+def _to_device_async(mix: torch.Tensor, samplerate: int) -> torch.Tensor:
+    """Stage each row of a CPU batch in a pooled pinned buffer and copy it to the GPU on a side stream."""
+    global _copy_stream
+    if _copy_stream is None:
+        _copy_stream = torch.cuda.Stream()
+    batch, channels, length = mix.shape
+    bucket = _bucket_length(length, samplerate)
+    mix_gpu = torch.empty(mix.shape, device="cuda")
+    
+    current = torch.cuda.current_stream()
+    _copy_stream.wait_stream(current)
+    staged_rows = []
+    with torch.cuda.stream(_copy_stream):
+        for row in range(batch):
+            pinned = _pinned_buffer(channels, bucket, row) if bucket is not None else None
+            if pinned is None:
+                mix_gpu[row].copy_(mix[row])
+                continue
+            staged = pinned[:channels * length].view(channels, length)
+            staged.copy_(mix[row])
+            mix_gpu[row].copy_(staged, non_blocking=True)
+            staged_rows.append(row)
+        copied = torch.cuda.Event()
+        copied.record()
+    current.wait_stream(_copy_stream)
+    for row in staged_rows:
+        _pinned_pool[(channels, bucket)][row][1] = copied
+    return mix_gpu
+
+# Chunks of a track are spread across this many CUDA streams
+CHUNK_STREAMS = int(os.environ.get("DEMUCS_CHUNK_STREAMS", 2))
+_chunk_streams: list[torch.cuda.Stream] = []
+
+class _StreamPool:
+    """
+    Executor for apply_model's `pool` hook that launches each chunk on the next of K streams.
+    
+    Kernel launches are asynchronous, so chunk i+1 is queued on its own stream while chunk i
+    is still running; result() only makes the caller's stream wait on the chunk's stream.
+    apply_model submits every chunk before collecting any, so at most K chunks are launched
+    ahead: the rest are deferred and chunk i+K starts when chunk i is collected. That keeps
+    ~K chunk outputs alive at once rather than one per chunk of the track.
+    """
+
+    class _Result:
+        def __init__(self, pool: "_StreamPool", func, args, kwargs):
+            self.pool = pool
+            self.call = (func, args, kwargs)
+            self.value: Optional[torch.Tensor] = None
+            self.stream: Optional[torch.cuda.Stream] = None
+
+        def launch(self, stream: torch.cuda.Stream) -> None:
+            func, args, kwargs = self.call
+            self.call = None
+            self.stream = stream
+            stream.wait_stream(torch.cuda.current_stream())
+            with torch.cuda.stream(stream):
+                self.value = func(*args, **kwargs)
+
+        def result(self) -> torch.Tensor:
+            self.pool._collect(self)
+            current = torch.cuda.current_stream()
+            current.wait_stream(self.stream)
+            self.value.record_stream(current)
+            value, self.value = self.value, None
+            return value
+
+    def __init__(self, streams: list[torch.cuda.Stream]):
+        self.streams = streams
+        self.index = 0
+        self.in_flight = 0
+        self.deferred: deque = deque()
+
+    def _launch(self, item: "_StreamPool._Result") -> None:
+        stream = self.streams[self.index % len(self.streams)]
+        self.index += 1
+        self.in_flight += 1
+        item.launch(stream)
+
+    def _collect(self, item: "_StreamPool._Result") -> None:
+        # Results are collected in submission order, but launch up to `item` if they aren't
+        while item.stream is None:
+            self._launch(self.deferred.popleft())
+        self.in_flight -= 1
+        if self.deferred:
+            self._launch(self.deferred.popleft())
+
+    def submit(self, func, *args, **kwargs) -> "_StreamPool._Result":
+        item = self._Result(self, func, args, kwargs)
+        if self.in_flight < len(self.streams):
+            self._launch(item)
+        else:
+            self.deferred.append(item)
+        return item
+
+    def shutdown(self, *_, **__) -> None:
+        # apply_model calls this when a result() raises (e.g. CUDA OOM); drop unlaunched chunks
+        self.deferred.clear()
+
+def _chunk_pool(device: str) -> Optional[_StreamPool]:
+    """Multi-stream pool for CUDA runs; compiled graph trees keep the default single stream."""
+    if device != "cuda" or CHUNK_STREAMS < 2 or COMPILE:
+        return None
+    if not _chunk_streams:
+        _chunk_streams.extend(torch.cuda.Stream() for _ in range(CHUNK_STREAMS))
+    return _StreamPool(_chunk_streams)
+
+@dataclass
+class HostStem:
+    """
+    A separated stem in host memory; `ready` fires once its async device-to-host copy lands.
+    
+    Stems of one track are views into a single (S, C, T) pinned buffer and share its event.
+    """
+    tensor: torch.Tensor
+    ready: Optional[torch.cuda.Event] = None
+
+    def wait(self) -> torch.Tensor:
+        if self.ready is not None:
+            self.ready.synchronize()
+        return self.tensor
+
+_d2h_stream: Optional[torch.cuda.Stream] = None
+
+def _to_host_async(names: list[str], stems: torch.Tensor) -> dict[str, HostStem]:
+    """Copy an (S, C, T) stack of stems into pinned host memory on a side stream in one transfer."""
+    global _d2h_stream
+    if _d2h_stream is None:
+        _d2h_stream = torch.cuda.Stream()
+    _d2h_stream.wait_stream(torch.cuda.current_stream())
+    with torch.cuda.stream(_d2h_stream):
+        pinned = torch.empty(stems.shape, dtype=stems.dtype, pin_memory=True)
+        pinned.copy_(stems, non_blocking=True)
+        stems.record_stream(_d2h_stream)
+        ready = torch.cuda.Event()
+        ready.record()
+    return {name: HostStem(tensor, ready) for name, tensor in zip(names, pinned.unbind(0))}
+
+def _load_waveform(path: str, separator: demucs.api.Separator) -> torch.Tensor:
+    """Decode an audio file with demucs' own loader, exactly as separate_audio_file does."""
+    return separator._load_audio(Path(path))
+
+def _decode_upload(file: UploadFile, separator: demucs.api.Separator) -> torch.Tensor:
+    """Decode an upload straight from its spooled file, without a temp-file round-trip."""
+    file.file.seek(0)
+    data, sr = sf.read(file.file, dtype="float32", always_2d=True)
+    wav = torch.from_numpy(data.T)
+    return convert_audio(wav, sr, separator.samplerate, separator.audio_channels)
+
+def _model_for_stems(separator: demucs.api.Separator, stems: Optional[frozenset[str]]) -> torch.nn.Module:
+    """
+    The separator's model, restricted to the bag members that contribute to `stems`.
+    
+    Fine-tuned bags such as htdemucs_ft hold one specialist per source with one-hot weights,
+    so a single-stem request only needs to run one of the networks.
+    """
+    model = separator.model
+    if stems is None or not isinstance(model, BagOfModels):
+        return model
+    wanted = [model.sources.index(name) for name in stems if name in model.sources]
+    keep = [(inner, weights) for inner, weights in zip(model.models, model.weights) if any(weights[k] for k in wanted)]
+    if not keep or len(keep) == len(model.models):
+        return model
+    return BagOfModels([inner for inner, _ in keep], [weights for _, weights in keep])
+
+def _run_batch(
+    separator: demucs.api.Separator,
+    wavs: list[torch.Tensor],
+    stems: list[Optional[frozenset[str]]],
+    shifts: int,
+    overlap: float
+) -> list[dict[str, HostStem]]:
+    """Separate several waveforms with a single padded, batched Demucs forward pass."""
+    lengths = [wav.shape[-1] for wav in wavs]
+    max_len = max(lengths)
+    # Normalize each item the same way Separator.separate_tensor does
+    refs = [wav.mean(0) for wav in wavs]
+    mix = torch.stack([
+        F.pad((wav - ref.mean()) / (ref.std() + 1e-8), (0, max_len - length))
+        for wav, ref, length in zip(wavs, refs, lengths)
+    ])
+    if separator._device == "cuda":
+        mix = _to_device_async(mix, separator.samplerate)
+    # Run only the networks needed for the union of the requested stems
+    needed = None if None in stems else frozenset().union(*stems)
+    with torch.inference_mode(), _autocast(separator._device):
+        out = apply_model(
+            _model_for_stems(separator, needed),
+            mix,
+            shifts=shifts,
+            split=separator._split,
+            overlap=overlap,
+            segment=separator._segment,
+            device=separator._device,
+            pool=_chunk_pool(separator._device),
+        )
+        sources = separator.model.sources
+        separations = []
+        for i, (ref, length, wanted) in enumerate(zip(refs, lengths, stems)):
+            # Keep the stems as one (S, C, T) stack so denormalization and the host copy are
+            # single ops; all sources are a view of `out`, a subset is gathered once
+            if wanted is None:
+                names, stack = list(sources), out[i, :, :, :length]
+            else:
+                index = [k for k, name in enumerate(sources) if name in wanted]
+                names = [sources[k] for k in index]
+                stack = out[i, index, :, :length]
+            separations.append((names, stack.mul_(ref.std() + 1e-8).add_(ref.mean())))
+    results = []
+    for names, stack in separations:
+        if out.is_cuda:
+            results.append(_to_host_async(names, stack))
+        else:
+            results.append({name: HostStem(tensor) for name, tensor in zip(names, stack.unbind(0))})
+    return results
+
+async def _batch_loop() -> None:
+    """Drain the separation queue, coalescing compatible jobs into batches."""
+    loop = asyncio.get_running_loop()
+    backlog: list[_SeparationJob] = []
+    while True:
+        batch: list[_SeparationJob] = []
+        # Any error fails the affected jobs but never the loop, or later requests would hang
+        try:
+            if not backlog:
+                backlog.append(await _separation_queue.get())
+            # No batching on CPU
+            limit = MAX_BATCH_SIZE if torch.cuda.is_available() else 1
+            deadline = loop.time() + BATCH_WINDOW_MS / 1000
+            while len(backlog) < limit:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    backlog.append(await asyncio.wait_for(_separation_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            # Only jobs with the same model and settings can share a forward pass
+            head = backlog[0]
+            batch = _select_batch(backlog, limit)
+            backlog = [job for job in backlog if job not in batch]
+            logger.info(f"Running separation batch of {len(batch)}")
+            results = await loop.run_in_executor(
+                _inference_executor,
+                _run_batch,
+                head.separator,
+                [job.wav for job in batch],
+                [job.stems for job in batch],
+                head.shifts,
+                head.overlap
+            )
+        except Exception as e:
+            logger.error(f"Separation batch failed: {e}", exc_info=True)
+            # Failed before a batch was picked (e.g. querying free VRAM): fail everything waiting
+            if not batch:
+                batch, backlog = backlog, []
+            for job in batch:
+                if not job.future.done():
+                    job.future.set_exception(e)
+        else:
+            for job, result in zip(batch, results):
+                if not job.future.done():
+                    job.future.set_result(result)
+
+async def separate_waveform(
+    separator: demucs.api.Separator,
+    wav: torch.Tensor,
+    stems: Optional[list[str]] = None,
+    shifts: int = DEFAULT_SHIFTS,
+    overlap: float = DEFAULT_OVERLAP
+) -> dict[str, HostStem]:
+    """Queue a waveform for batched separation and wait for its stems (all, or just `stems`)."""
+    global _separation_queue, _batch_worker
+    if _separation_queue is None:
+        _separation_queue = asyncio.Queue()
+    if _batch_worker is None or _batch_worker.done():
+        _batch_worker = asyncio.create_task(_batch_loop())
+    future = asyncio.get_running_loop().create_future()
+    job = _SeparationJob(separator, wav, future, frozenset(stems) if stems else None, shifts, overlap)
+    await _separation_queue.put(job)
+    return await future
+
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+async def save_upload(file: UploadFile) -> str:
+    """Stream an upload to a temp file in 1 MiB chunks so it is never fully buffered in RAM."""
+    await file.seek(0)
+    with tempfile.NamedTemporaryFile(suffix=Path(file.filename).suffix, delete=False) as tmp:
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            tmp.write(chunk)
+        return tmp.name
+
+async def load_upload(file: UploadFile, separator: demucs.api.Separator) -> torch.Tensor:
+    """Decode an upload in memory, falling back to a temp file for containers libsndfile can't read (e.g. m4a)."""
+    try:
+        return await asyncio.to_thread(_decode_upload, file, separator)
+    except sf.SoundFileError as e:
+        logger.info(f"In-memory decode failed ({e}), falling back to temp file")
+    tmp_path = await save_upload(file)
+    try:
+        return await asyncio.to_thread(_load_waveform, tmp_path, separator)
+    finally:
+        os.unlink(tmp_path)
+
+def _hash_upload(file: UploadFile) -> str:
+    """BLAKE3 digest of the upload contents, read in chunks."""
+    file.file.seek(0)
+    hasher = blake3()
+    while chunk := file.file.read(UPLOAD_CHUNK_SIZE):
+        hasher.update(chunk)
+    file.file.seek(0)
+    return hasher.hexdigest()
+
+# Result cache: encoded stems stored under {CACHE_DIR}/{upload hash}/{model}/{stem}.{format}
+CACHE_DIR = Path(os.environ.get("DEMUCS_CACHE_DIR", "/tmp/demucs-cache"))
+CACHE_MAX_BYTES = int(os.environ.get("DEMUCS_CACHE_MAX_BYTES", 10 * 1024**3))
+CACHE_SWEEP_SECONDS = int(os.environ.get("DEMUCS_CACHE_SWEEP_SECONDS", 300))
+CACHE_ENABLED = CACHE_MAX_BYTES > 0
+
+# Model and stem names come from the query string; only plain names may become paths
+_SAFE_NAME = re.compile(r"[\w-]+")
+
+def _cache_dir(track_id: str, model: str, shifts: int, overlap: float) -> Optional[Path]:
+    """Cache directory for an upload and separation settings, or None when caching is disabled."""
+    if not CACHE_ENABLED or not _SAFE_NAME.fullmatch(model):
+        return None
+    return CACHE_DIR / track_id / f"{model}-shifts{shifts}-overlap{overlap:g}"
+
+def _touch_cache(directory: Path) -> None:
+    """Mark an upload's cache entry as recently used for LRU eviction."""
+    with contextlib.suppress(OSError):
+        os.utime(directory.parent)
 
-def get_separator(model: str = "htdemucs") -> demucs.api.Separator:
-    """Get or create the Demucs separator (cached for performance)."""
-    global _separator
-    if _separator is None:
-        logger.info(f"Loading Demucs model: {model}")
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        logger.info(f"Using device: {device}")
-        _separator = demucs.api.Separator(model=model, device=device)
-        logger.info("Model loaded successfully")
-    return _separator
+def read_cache(directory: Optional[Path], format: str, stem: Optional[str] = None) -> Optional[dict[str, Path]]:
+    """Paths of cached stems (all stems, or just `stem`) in a cache directory, or None on a miss (blocking I/O)."""
+    if directory is None:
+        return None
+    if stem is not None:
+        if not _SAFE_NAME.fullmatch(stem):
+            return None
+        names = [stem]
+    else:
+        # The manifest is written only once every stem of this format is on disk
+        manifest = directory / f"{format}.json"
+        if not manifest.exists():
+            return None
+        names = json.loads(manifest.read_text())
+    paths = {name: directory / f"{name}.{format}" for name in names}
+    if not all(path.exists() for path in paths.values()):
+        return None
+    _touch_cache(directory)
+    return paths
+
+def _file_sizes(paths: dict[str, Path]) -> dict[str, int]:
+    """Sizes of cached stem files, for the metadata response on a cache hit."""
+    return {name: path.stat().st_size for name, path in paths.items()}
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    """Write a cache file via rename so readers never see a partial file."""
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning(f"Failed to write cache file {path}: {e}")
+
+def write_cache_manifest(directory: Optional[Path], format: str, names: list[str]) -> None:
+    """Record that every stem of `format` in this cache directory is on disk."""
+    if directory is not None:
+        _write_atomic(directory / f"{format}.json", json.dumps(names).encode())
+        _touch_cache(directory)
+
+def _sweep_cache() -> None:
+    """Delete least recently used cache entries until the cache fits in CACHE_MAX_BYTES."""
+    if not CACHE_DIR.exists():
+        return
+    entries = []
+    for entry in CACHE_DIR.iterdir():
+        try:
+            size = sum(f.stat().st_size for f in entry.rglob("*") if f.is_file())
+            entries.append((entry.stat().st_mtime, size, entry))
+        except OSError:
+            continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries, key=lambda e: e[0]):
+        if total <= CACHE_MAX_BYTES:
+            break
+        logger.info(f"Evicting cached separation {entry.name}")
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+async def _cache_sweeper() -> None:
+    """Periodically enforce the cache size limit."""
+    while True:
+        try:
+            await asyncio.to_thread(_sweep_cache)
+        except Exception as e:
+            logger.warning(f"Cache sweep failed: {e}")
+        await asyncio.sleep(CACHE_SWEEP_SECONDS)
+
+# Output encodings: format (also the file extension) -> (soundfile container, subtype)
+# FLAC is lossless and ~40% smaller than PCM WAV, at far less CPU than zipping WAV;
+# MP3 / Opus are lossy but ~10x smaller (needs libsndfile >= 1.1, bundled with soundfile wheels)
+AUDIO_FORMATS = {
+    "wav": ("WAV", "PCM_16"),
+    "flac": ("FLAC", "PCM_16"),
+    "mp3": ("MP3", "MPEG_LAYER_III"),
+    "opus": ("OGG", "OPUS"),
+}
+# Opus only supports 8/12/16/24/48 kHz
+OPUS_SAMPLERATE = 48000
+
+def wav_to_bytes(tensor: torch.Tensor, sr: int, format: str = "wav") -> bytes:
+    """Encode a (channels, samples) tensor in one of AUDIO_FORMATS (16-bit WAV by default)."""
+    container, subtype = AUDIO_FORMATS[format]
+    tensor = tensor.detach().cpu().float()
+    if format == "opus" and sr != OPUS_SAMPLERATE:
+        tensor = torchaudio.functional.resample(tensor, sr, OPUS_SAMPLERATE)
+        sr = OPUS_SAMPLERATE
+    wav = tensor.clamp(-1, 1).numpy().T
+    buffer = io.BytesIO()
+    sf.write(buffer, wav, sr, format=container, subtype=subtype)
+    return buffer.getvalue()
+
+def encode_stem(
+    name: str,
+    stem: HostStem,
+    sr: int,
+    format: str = "wav",
+    cache_dir: Optional[Path] = None
+) -> tuple[str, bytes]:
+    """Encode one stem (and write it to the cache); runs in a worker thread so stems encode in parallel."""
+    data = wav_to_bytes(stem.wait(), sr, format)
+    if cache_dir is not None:
+        _write_atomic(cache_dir / f"{name}.{format}", data)
+    return name, data
+
+async def encode_stems(
+    separated: dict[str, HostStem],
+    sr: int,
+    format: str = "wav",
+    cache_dir: Optional[Path] = None
+) -> list[tuple[str, bytes]]:
+    """Encode all stems concurrently, preserving the model's stem order."""
+    return await asyncio.gather(*[
+        asyncio.to_thread(encode_stem, name, stem, sr, format, cache_dir)
+        for name, stem in separated.items()
+    ])
+
+async def stream_zip(
+    separated: dict[str, HostStem],
+    sr: int,
+    format: str = "wav",
+    cache_dir: Optional[Path] = None
+) -> AsyncIterator[bytes]:
+    """Yield a stored ZIP of the stems, adding each stem as soon as its encode finishes."""
+    zs = ZipStream(compress_type=zipfile.ZIP_STORED)
+    pending = [
+        asyncio.ensure_future(asyncio.to_thread(encode_stem, name, stem, sr, format, cache_dir))
+        for name, stem in separated.items()
+    ]
+    try:
+        for next_done in asyncio.as_completed(pending):
+            name, data = await next_done
+            zs.add(data, f"{name}.{format}")
+            for chunk in zs.all_files():
+                yield chunk
+        for chunk in zs.footer():
+            yield chunk
+        await asyncio.to_thread(write_cache_manifest, cache_dir, format, list(separated))
+    finally:
+        for task in pending:
+            task.cancel()
 
 class StemInfo(BaseModel):
     name: str
@@ -51,79 +841,91 @@ class SeparationResult(BaseModel):
     model: str
     device: str
 
+# Set once the model is loaded and a dummy forward pass has primed cuDNN / CUDA graphs
+_warm = False
+_warmup_task: Optional[asyncio.Task] = None
+_cache_sweeper_task: Optional[asyncio.Task] = None
+
+WARMUP_RETRY_SECONDS = 5
+WARMUP_RETRY_MAX_SECONDS = 300
+
+async def _warmup():
+    """Load the model off the event loop, then run a short dummy separation, retrying with backoff."""
+    global _warm
+    delay = WARMUP_RETRY_SECONDS
+    while True:
+        try:
+            separator = await get_separator()
+            if torch.cuda.is_available():
+                # On the inference thread, which owns the staging pool
+                await asyncio.get_running_loop().run_in_executor(
+                    _inference_executor, _preallocate_buffers, separator.audio_channels, separator.samplerate
+                )
+            silence = torch.zeros(separator.audio_channels, separator.samplerate * 2)
+            await separate_waveform(separator, silence)
+            _warm = True
+            logger.info("Model warmed up")
+            return
+        except Exception as e:
+            # A download blip or transient CUDA error must not keep the worker out of rotation
+            logger.warning(f"Failed to warm up model, retrying in {delay}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WARMUP_RETRY_MAX_SECONDS)
+
 @app.on_event("startup")
 async def startup_event():
-    """Pre-load the model on startup for faster first request."""
-    try:
-        get_separator()
-    except Exception as e:
-        logger.warning(f"Failed to pre-load model: {e}")
+    """Warm the model in the background so startup doesn't block on loading weights."""
+    global _warmup_task, _cache_sweeper_task
+    _warmup_task = asyncio.create_task(_warmup())
+    if CACHE_ENABLED:
+        _cache_sweeper_task = asyncio.create_task(_cache_sweeper())
 
 @app.get("/health")
 async def health_check():
-    """Health check endpoint."""
+    """Health check endpoint. Load balancers should wait for `warm` before routing traffic."""
     device = "cuda" if torch.cuda.is_available() else "cpu"
     return {
         "status": "healthy",
         "device": device,
         "cuda_available": torch.cuda.is_available(),
-        "model_loaded": _separator is not None
+        "model_loaded": bool(_separators),
+        "models": list(_separators),
+        "warm": _warm
     }
 
 @app.post("/separate")
 async def separate_audio(
     file: UploadFile = File(...),
     model: str = Query(default="htdemucs", description="Demucs model to use"),
-    stem: Optional[str] = Query(default=None, description="Return only this stem (vocals, drums, bass, other)")
+    stem: Optional[str] = Query(default=None, description="Return only this stem (vocals, drums, bass, other)"),
+    shifts: int = Query(default=DEFAULT_SHIFTS, ge=0, le=10, description="Random time shifts to average (quality vs. speed)"),
+    overlap: float = Query(default=DEFAULT_OVERLAP, ge=0.0, lt=1.0, description="Overlap between split chunks")
 ):
     """
     Separate audio into stems using Demucs.
     
     Returns a multipart response with all stems, or a single stem if specified.
+    
+    The defaults favour throughput. Each shift re-runs the model on a randomly offset copy
+    of the input (up to ~0.2 dB SDR better, N times slower); a larger overlap smooths chunk
+    boundaries at the cost of proportionally more chunks (demucs' own default is 0.25).
     """
     if not file.filename:
         raise HTTPException(status_code=400, detail="No filename provided")
     
-    track_id = str(uuid.uuid4())
+    # Identical uploads share a track id, which keys the result cache
+    track_id = await asyncio.to_thread(_hash_upload, file)
     
     try:
-        # Read uploaded file
-        content = await file.read()
-        logger.info(f"Processing file: {file.filename} ({len(content)} bytes)")
-        
-        # Save to temp file (Demucs needs file path)
-        with tempfile.NamedTemporaryFile(suffix=Path(file.filename).suffix, delete=False) as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
+        logger.info(f"Processing file: {file.filename} ({file.size} bytes)")
         
-        try:
-            # Get separator and process
-            separator = get_separator(model)
-            
-            # Separate stems
-            logger.info(f"Separating stems for track {track_id}")
-            origin, separated = separator.separate_audio_file(tmp_path)
-            
-            # Get stem names from the model
-            stem_names = list(separated.keys())
-            logger.info(f"Separated into stems: {stem_names}")
-            
-            # If specific stem requested, return just that one
+        cache_dir = _cache_dir(track_id, model, shifts, overlap)
+        cached = await asyncio.to_thread(read_cache, cache_dir, "wav", stem)
+        if cached is not None:
+            logger.info(f"Serving track {track_id} from cache")
             if stem:
-                if stem not in separated:
-                    raise HTTPException(
-                        status_code=400, 
-                        detail=f"Stem '{stem}' not found. Available: {stem_names}"
-                    )
-                
-                # Convert to bytes
-                stem_tensor = separated[stem]
-                buffer = io.BytesIO()
-                torchaudio.save(buffer, stem_tensor, separator.samplerate, format="wav")
-                buffer.seek(0)
-                
-                return StreamingResponse(
-                    buffer,
+                return FileResponse(
+                    cached[stem],
                     media_type="audio/wav",
                     headers={
                         "Content-Disposition": f'attachment; filename="{stem}.wav"',
@@ -131,25 +933,61 @@ async def separate_audio(
                         "X-Stem-Name": stem
                     }
                 )
-            
-            # Return all stems as multipart or JSON with URLs
-            # For simplicity, we'll return metadata and let client fetch individual stems
-            stems_info = []
-            for name, tensor in separated.items():
-                buffer = io.BytesIO()
-                torchaudio.save(buffer, tensor, separator.samplerate, format="wav")
-                stems_info.append(StemInfo(name=name, size_bytes=buffer.tell()))
-            
+            sizes = await asyncio.to_thread(_file_sizes, cached)
             return SeparationResult(
                 track_id=track_id,
-                stems=stems_info,
+                stems=[StemInfo(name=name, size_bytes=size) for name, size in sizes.items()],
                 model=model,
                 device="cuda" if torch.cuda.is_available() else "cpu"
             )
+        
+        # Get separator and process
+        separator = await get_separator(model)
+        
+        # Get stem names from the model
+        stem_names = list(separator.model.sources)
+        if stem and stem not in stem_names:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Stem '{stem}' not found. Available: {stem_names}"
+            )
+        
+        # Separate stems (only the requested one when a stem is given)
+        logger.info(f"Separating stems for track {track_id}")
+        wav = await load_upload(file, separator)
+        separated = await separate_waveform(separator, wav, [stem] if stem else None, shifts, overlap)
+        logger.info(f"Separated into stems: {list(separated)}")
+        
+        # If specific stem requested, return just that one
+        if stem:
+            # Convert to bytes
+            _, stem_bytes = await asyncio.to_thread(
+                encode_stem, stem, separated[stem], separator.samplerate, "wav", cache_dir
+            )
+            buffer = io.BytesIO(stem_bytes)
             
-        finally:
-            # Cleanup temp file
-            os.unlink(tmp_path)
+            return StreamingResponse(
+                buffer,
+                media_type="audio/wav",
+                headers={
+                    "Content-Disposition": f'attachment; filename="{stem}.wav"',
+                    "X-Track-Id": track_id,
+                    "X-Stem-Name": stem
+                }
+            )
+        
+        # Return all stems as multipart or JSON with URLs
+        # For simplicity, we'll return metadata and let client fetch individual stems
+        encoded = await encode_stems(separated, separator.samplerate, "wav", cache_dir)
+        await asyncio.to_thread(write_cache_manifest, cache_dir, "wav", stem_names)
+        stems_info = [StemInfo(name=name, size_bytes=len(data)) for name, data in encoded]
+        
+        return SeparationResult(
+            track_id=track_id,
+            stems=stems_info,
+            model=model,
+            device="cuda" if torch.cuda.is_available() else "cpu"
+        )
             
     except HTTPException:
         raise
@@ -161,56 +999,49 @@ async def separate_audio(
 async def separate_all_stems(
     file: UploadFile = File(...),
     model: str = Query(default="htdemucs", description="Demucs model to use"),
-    format: str = Query(default="wav", description="Output format (wav or mp3)")
+    format: str = Query(default="wav", description="Output format (wav, flac, mp3 or opus)"),
+    shifts: int = Query(default=DEFAULT_SHIFTS, ge=0, le=10, description="Random time shifts to average (quality vs. speed)"),
+    overlap: float = Query(default=DEFAULT_OVERLAP, ge=0.0, lt=1.0, description="Overlap between split chunks")
 ):
     """
     Separate audio and return all stems as a ZIP archive.
-    """
-    import zipfile
     
+    The archive is streamed: each stem is written as soon as it is encoded.
+    `shifts` and `overlap` trade speed for quality as described on /separate.
+    """
     if not file.filename:
         raise HTTPException(status_code=400, detail="No filename provided")
+    if format not in AUDIO_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format '{format}'")
     
-    track_id = str(uuid.uuid4())
+    track_id = await asyncio.to_thread(_hash_upload, file)
+    headers = {
+        "Content-Disposition": f'attachment; filename="stems_{track_id}.zip"',
+        "X-Track-Id": track_id
+    }
     
     try:
-        content = await file.read()
-        logger.info(f"Processing file for all stems: {file.filename}")
+        logger.info(f"Processing file for all stems: {file.filename} ({file.size} bytes)")
         
-        with tempfile.NamedTemporaryFile(suffix=Path(file.filename).suffix, delete=False) as tmp:
-            tmp.write(content)
-            tmp_path = tmp.name
+        cache_dir = _cache_dir(track_id, model, shifts, overlap)
+        cached = await asyncio.to_thread(read_cache, cache_dir, format)
+        if cached is not None:
+            logger.info(f"Serving track {track_id} from cache")
+            zs = ZipStream(compress_type=zipfile.ZIP_STORED)
+            for name, path in cached.items():
+                zs.add_path(path, f"{name}.{format}")
+            return StreamingResponse(zs, media_type="application/zip", headers=headers)
         
-        try:
-            separator = get_separator(model)
-            origin, separated = separator.separate_audio_file(tmp_path)
-            
-            # Create ZIP with all stems
-            zip_buffer = io.BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for name, tensor in separated.items():
-                    stem_buffer = io.BytesIO()
-                    if format == "mp3":
-                        # MP3 requires additional encoding
-                        torchaudio.save(stem_buffer, tensor, separator.samplerate, format="wav")
-                    else:
-                        torchaudio.save(stem_buffer, tensor, separator.samplerate, format="wav")
-                    stem_buffer.seek(0)
-                    zf.writestr(f"{name}.wav", stem_buffer.read())
-            
-            zip_buffer.seek(0)
-            
-            return StreamingResponse(
-                zip_buffer,
-                media_type="application/zip",
-                headers={
-                    "Content-Disposition": f'attachment; filename="stems_{track_id}.zip"',
-                    "X-Track-Id": track_id
-                }
-            )
-            
-        finally:
-            os.unlink(tmp_path)
+        separator = await get_separator(model)
+        wav = await load_upload(file, separator)
+        separated = await separate_waveform(separator, wav, shifts=shifts, overlap=overlap)
+        
+        # Stream ZIP with all stems (stored: PCM/FLAC audio doesn't deflate meaningfully)
+        return StreamingResponse(
+            stream_zip(separated, separator.samplerate, format, cache_dir),
+            media_type="application/zip",
+            headers=headers
+        )
             
     except Exception as e:
         logger.error(f"Separation failed: {e}", exc_info=True)
@@ -220,12 +1051,32 @@ async def separate_all_stems(
 async def get_single_stem(
     stem_name: str,
     file: UploadFile = File(...),
-    model: str = Query(default="htdemucs")
+    model: str = Query(default="htdemucs"),
+    shifts: int = Query(default=DEFAULT_SHIFTS, ge=0, le=10),
+    overlap: float = Query(default=DEFAULT_OVERLAP, ge=0.0, lt=1.0)
 ):
     """Convenience endpoint to get a single stem directly."""
-    return await separate_audio(file=file, model=model, stem=stem_name)
+    return await separate_audio(file=file, model=model, stem=stem_name, shifts=shifts, overlap=overlap)
+
+def _default_workers() -> int:
+    """One worker on a GPU without CUDA MPS (workers would time-slice and hold duplicate models), else two."""
+    mps_pipe = os.environ.get("CUDA_MPS_PIPE_DIRECTORY", "/tmp/nvidia-mps")
+    if torch.cuda.is_available() and not os.path.exists(mps_pipe):
+        return 1
+    return 2
 
 if __name__ == "__main__":
     import uvicorn
     port = int(os.environ.get("PORT", 8001))
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # Each worker process loads its own separators and caching allocator, and cannot see the
+    # others' VRAM use; workers inherit WEB_CONCURRENCY and budget 1/N of free VRAM each.
+    workers = int(os.environ.get("WEB_CONCURRENCY", _default_workers()))
+    os.environ["WEB_CONCURRENCY"] = str(workers)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=port,
+        workers=workers,
+        loop="uvloop",
+        http="httptools"
+    )